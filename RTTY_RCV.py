@@ -1,7 +1,23 @@
 import numpy as np
-from scipy.signal import find_peaks
+from scipy.signal import butter, decimate, find_peaks, sosfiltfilt
 from scipy.io import wavfile
-import matplotlib.pyplot as plt
+
+
+def _pack_code(code):
+    """Упаковывает 5‑битный код ITA2 в целое число (первый бит — старший)."""
+    value = 0
+    for bit in code:
+        value = (value << 1) | bit
+    return value
+
+
+def _code_table(table, default):
+    """Раскладывает словарь «5‑битный код → значение» в список на все 32 кода."""
+    values = [default] * 32
+    for code, value in table.items():
+        values[_pack_code(code)] = value
+    return values
+
 
 class RTTYDecoder:
     """Декодирует RTTY‑сигнал (FSK) в текст по стандарту ITA2."""
@@ -51,70 +67,222 @@ class RTTYDecoder:
         }
     }
 
+    # Полосовые фильтры работают на частоте дискретизации, прореженной не ниже
+    # чем до DECIMATION_MARGIN × верхняя граница полосы фильтра
+    DECIMATION_MARGIN = 3
 
+    # Размер блока данных, обрабатываемого за раз (чтобы помещался в кэш L2)
+    TILE_BYTES = 256 * 1024
 
+    # Те же таблицы в виде массивов, индекс — упакованный 5‑битный код:
+    # _CHAR_TABLE[режим, код] — символ, _SWITCH_MODES[код] — новый режим или -1
+    _MODES = tuple(ITA2_MODES)
+    _CHAR_TABLE = np.array([_code_table(table, '?') for table in ITA2_MODES.values()],
+                           dtype='U1')
+    _SWITCH_MODES = np.array(
+        _code_table(dict(zip(MODE_SWITCH, map(_MODES.index, MODE_SWITCH.values()))), -1),
+        dtype=np.int8)
 
-    def __init__(self, baud=45.45, mark_freq=1170, space_freq=1000, sample_rate=44100):
+
+
+
+    def __init__(self, baud=45.45, mark_freq=1170, space_freq=1000, sample_rate=44100,
+                 detector='goertzel'):
+        if detector not in ('goertzel', 'bandpass'):
+            raise ValueError(f"Неизвестный детектор: {detector}")
         self.baud = baud
         self.mark_freq = mark_freq
         self.space_freq = space_freq
         self.sample_rate = sample_rate
         self.bit_duration = 1.0 / baud  # длительность одного бита (сек)
         self.n_samples_per_bit = int(sample_rate * self.bit_duration)
+        self.detector = detector  # 'goertzel' — однобиновое ДПФ, 'bandpass' — полосовые фильтры
+
+        # Опорные косинусы и синусы на частотах mark и space (на один бит) — столбцы
+        # одной вещественной матрицы: энергии обоих тонов для любого числа сегментов
+        # даёт одно умножение float32 без перевода сигнала в комплексный тип
+        t = np.arange(self.n_samples_per_bit) / sample_rate
+        self._kernels = np.column_stack([
+            np.cos(2 * np.pi * mark_freq * t), np.sin(2 * np.pi * mark_freq * t),
+            np.cos(2 * np.pi * space_freq * t), np.sin(2 * np.pi * space_freq * t),
+        ]).astype(np.float32)
+
+        # Полосовые фильтры (секции второго порядка) рассчитываются один раз —
+        # сразу для частоты дискретизации после прореживания
+        self._decimation = self._decimation_factor(max(mark_freq, space_freq) + 50)
+        filter_rate = sample_rate / self._decimation
+        self._sos_mark = self._design_bandpass(mark_freq - 50, mark_freq + 50, filter_rate)
+        self._sos_space = self._design_bandpass(space_freq - 50, space_freq + 50, filter_rate)
+
+        # Длина дополнения краёв для sosfiltfilt — как у filtfilt для того же порядка
+        # (3 × длина числителя); считаем один раз, а не при каждом вызове
+        self._padlen = 3 * (2 * len(self._sos_mark) + 1)
+
+
+    def _decimation_factor(self, max_freq):
+        """
+        Коэффициент прореживания сигнала перед полосовыми фильтрами: наибольший
+        делитель длины бита (так сетка битов не сдвигается), при котором частота
+        дискретизации остаётся не ниже DECIMATION_MARGIN × max_freq. Не больше 13 —
+        предел для однократного decimate.
+        """
+        limit = min(13, int(self.sample_rate // (self.DECIMATION_MARGIN * max_freq)))
+        for factor in range(limit, 1, -1):
+            if self.n_samples_per_bit % factor == 0:
+                return factor
+        return 1
 
 
-    def _bandpass_filter(self, signal, low, high, order=5):
+    def _design_bandpass(self, low, high, rate, order=5):
+        """Рассчитывает полосовой фильтр Баттерворта в виде секций второго порядка."""
+        nyq = 0.5 * rate
+        return butter(order, [low / nyq, high / nyq], btype='band', output='sos')
+
+
+    def _bandpass_filter(self, signal, sos):
         """Полосовой фильтр для выделения частоты."""
-        from scipy.signal import butter, filtfilt
-        nyq = 0.5 * self.sample_rate
-        low = low / nyq
-        high = high / nyq
-        b, a = butter(order, [low, high], btype='band')
-        return filtfilt(b, a, signal)
+        return sosfiltfilt(sos, signal, padlen=self._padlen)
 
 
     def _detect_frequency(self, segment):
         """Определяет, какая частота преобладает в сегменте (mark или space)."""
-        # Фильтруем сигнал в диапазонах mark и space
-        mark_filtered = self._bandpass_filter(segment, self.mark_freq - 50, self.mark_freq + 50)
-        space_filtered = self._bandpass_filter(segment, self.space_freq - 50, self.space_freq + 50)
-
-        # Вычисляем энергию в каждом диапазоне
-        mark_energy = np.sum(mark_filtered ** 2)
-        space_energy = np.sum(space_filtered ** 2)
+        # Энергия на частотах mark и space — один бин ДПФ (алгоритм Гёрцеля)
+        # как скалярное произведение с опорными колебаниями
+        power = (segment @ self._kernels[:len(segment)]) ** 2
+        mark_energy = power[0] + power[1]
+        space_energy = power[2] + power[3]
 
         # Сравниваем энергии: где больше — та частота и преобладает
         return 'mark' if mark_energy > space_energy else 'space'
 
 
-    def demodulate(self, signal):
-        """Демодулирует RTTY‑сигнал в битовую последовательность."""
-        bits = []
-        n_samples = len(signal)
+    def _detect_bits(self, frames):
+        """Определяет биты сразу для матрицы сегментов (одна строка — один бит)."""
+        # Энергии всех сегментов — одним матричным умножением на опорные колебания
+        power = (frames @ self._kernels) ** 2
+        mark_energy = power[:, 0] + power[:, 1]
+        space_energy = power[:, 2] + power[:, 3]
+        return (mark_energy > space_energy).astype(np.uint8)
+
+
+    def _detect_bits_filtered(self, signal):
+        """
+        Определяет биты полосовыми фильтрами: сигнал прореживается и фильтруется
+        целиком один раз, энергия бита — сумма квадратов отфильтрованного сигнала
+        по его сегменту.
+        """
+        if len(signal) == 0:
+            return np.array([], dtype=np.uint8)
+
+        # Тонам ~1 кГц хватает частоты дискретизации в несколько кГц, а фильтрация —
+        # самая дорогая часть, поэтому сначала прореживаем сигнал
+        if self._decimation > 1:
+            signal = decimate(signal, self._decimation, ftype='fir')
+        samples_per_bit = self.n_samples_per_bit // self._decimation
+
+        mark_filtered = self._bandpass_filter(signal, self._sos_mark)
+        space_filtered = self._bandpass_filter(signal, self._sos_space)
 
-        for i in range(0, n_samples, self.n_samples_per_bit):
-            segment = signal[i:i + self.n_samples_per_bit]
-            if len(segment) < self.n_samples_per_bit // 2:
-                continue  # слишком короткий сегмент — пропускаем
+        # Суммы по сегментам; последний сегмент может быть неполным
+        starts = np.arange(0, len(signal), samples_per_bit)
+        mark_energy = np.add.reduceat(mark_filtered * mark_filtered, starts)
+        space_energy = np.add.reduceat(space_filtered * space_filtered, starts)
+        return (mark_energy > space_energy).astype(np.uint8)
 
 
-            # Определяем частоту в сегменте
-            freq_type = self._detect_frequency(segment)
-            bit = 1 if freq_type == 'mark' else 0
-            bits.append(bit)
+    def _to_float(self, samples, scale, out=None):
+        """Переводит отсчёты во float32 с умножением на scale за один проход."""
+        return np.multiply(samples, np.float32(scale), out=out, dtype=np.float32)
+
+
+    def demodulate(self, signal, scale=1.0):
+        """
+        Демодулирует RTTY‑сигнал в битовую последовательность.
+        Отсчёты умножаются на scale (нормализация) по ходу обработки.
+        """
+        n_bits = len(signal) // self.n_samples_per_bit
+        n_full = n_bits * self.n_samples_per_bit
+
+        # Неполный хвост учитываем, только если он не короче половины бита
+        tail = signal[n_full:]
+        if len(tail) < self.n_samples_per_bit // 2:
+            tail = tail[:0]
+
+        if self.detector == 'bandpass':
+            samples = self._to_float(signal[:n_full + len(tail)], scale)
+            return self._detect_bits_filtered(samples).tolist()
+
+        # Полные сегменты обрабатываем блоками по целому числу битов, помещающимися
+        # в кэш вместе с опорными экспонентами: блок переводится во float32
+        # в заранее выделенный буфер и сразу демодулируется
+        tile_bits = max(1, (self.TILE_BYTES - self._kernels.nbytes) // (4 * self.n_samples_per_bit))
+        tile = np.empty(tile_bits * self.n_samples_per_bit, dtype=np.float32)
+
+        bits = np.empty(n_bits, dtype=np.uint8)
+        for first in range(0, n_bits, tile_bits):
+            count = min(tile_bits, n_bits - first)
+            start = first * self.n_samples_per_bit
+            stop = start + count * self.n_samples_per_bit
+            frames = self._to_float(signal[start:stop], scale, out=tile[:stop - start])
+            bits[first:first + count] = self._detect_bits(frames.reshape(count, self.n_samples_per_bit))
+        bits = bits.tolist()
+
+        if len(tail) > 0:
+            freq_type = self._detect_frequency(self._to_float(tail, scale))
+            bits.append(1 if freq_type == 'mark' else 0)
 
         return bits
 
 
-    def _decode_ita2_char(self, code, current_mode):
-        """Декодирует 5‑битный код в символ с учётом текущего режима."""
-        code_tuple = tuple(code)
-        if code_tuple in self.MODE_SWITCH:
-            return self.MODE_SWITCH[code_tuple]
-        if (current_mode in self.ITA2_MODES
-                and code_tuple in self.ITA2_MODES[current_mode]):
-            return self.ITA2_MODES[current_mode][code_tuple]
-        return '?'
+    def _symbol_modes(self, codes, initial_mode):
+        """
+        Определяет режим (индекс в _MODES) для каждого символа: действует последнее
+        предшествующее переключение, а до первого переключения — initial_mode.
+        Возвращает режимы и признаки переключения (-1 для обычных символов).
+        """
+        switches = self._SWITCH_MODES[codes]
+        positions = np.where(switches >= 0, np.arange(len(codes)), -1)
+        last_switch = np.maximum.accumulate(positions)
+        modes = np.where(last_switch >= 0, switches[last_switch], self._MODES.index(initial_mode))
+        return modes, switches
+
+
+    @staticmethod
+    def _pack_codes(bits, starts):
+        """Упаковывает 5 битов данных после каждого старт‑бита в целые коды."""
+        data = bits[np.asarray(starts, dtype=np.intp)[:, None] + np.arange(1, 6)]
+        return data @ np.array([16, 8, 4, 2, 1], dtype=np.uint8)
+
+
+    def _frame_bits(self, bits):
+        """
+        Выделяет символы из битового потока: старт‑бит 0, 5 битов данных,
+        стоп‑бит из одной или нескольких 1 (поддерживается длина 1.5).
+        Возвращает упакованные коды символов.
+        """
+        bits = np.asarray(bits, dtype=np.uint8)
+        buf = bits.tobytes()  # поиск нулей и единиц — через bytes.find
+        n = len(buf)
+
+        starts = []
+        i = 0
+        while True:
+            # Ищем старт‑бит (0); нужно минимум 7 битов (старт + 5 данных + стоп)
+            start = buf.find(b'\x00', i)
+            if start < 0 or start + 6 >= n:
+                break
+
+            # Стоп‑бит — первая 1 после данных, символ заканчивается с концом серии единиц
+            stop = buf.find(b'\x01', start + 6)
+            if stop < 0:
+                break
+
+            starts.append(start)
+            i = buf.find(b'\x00', stop)
+            if i < 0:
+                break
+
+        return self._pack_codes(bits, starts)
 
 
     def decode_bits(self, bits):
@@ -123,71 +291,13 @@ class RTTYDecoder:
         Учитывает старт/стоп‑биты и переключение режимов (LAT/RUS/FIGS).
         Поддерживает стоп‑бит длиной 1.5.
         """
-        text = []
-        current_mode = 'LAT'  # начальный режим
-        bit_buffer = []  # буфер для битов символа
-        i = 0  # индекс в массиве bits
-
-        while i < len(bits):
-            bit = bits[i]
-            bit_buffer.append(bit)
-
-            # Ищем старт‑бит (0) в начале буфера
-            if len(bit_buffer) == 1 and bit != 0:
-                # Не старт‑бит — сбрасываем буфер
-                bit_buffer = []
-                i += 1
-                continue
-
-            # Если набрали 7 битов (старт + 5 данных + стоп)
-            if len(bit_buffer) >= 7:
-                # Проверяем, что старт‑бит = 0
-                if bit_buffer[0] != 0:
-                    bit_buffer = []
-                    continue
-
-                # Извлекаем 5 битов данных
-                data_bits = bit_buffer[1:6]
-
-                # Ищем стоп‑бит: он может быть 1 (1×) или 1,1 (1.5×)
-                stop_pattern = []
-                j = i  # начинаем с текущего индекса
-                while j < len(bits) and bits[j] == 1:
-                    stop_pattern.append(bits[j])
-                    j += 1
-
-                stop_length = len(stop_pattern)
-
-                # Если стоп‑бит есть (хотя бы 1 единица), считаем символ завершённым
-                if stop_length >= 1:
-                    # Декодируем символ с учётом текущего режима
-                    char = self._decode_ita2_char(data_bits, current_mode)
-                    
-                    #print(f"Биты: {bit_buffer} → Данные: {data_bits} → Символ: {repr(char)} (режим: {current_mode})")
-                    
-                    if char == 'RUS':
-                        current_mode = 'RUS'
-                    elif char == 'FIGS':
-                        current_mode = 'FIGS'
-                    elif char == 'LAT':
-                        current_mode = 'LAT'
-                    else:
-                        text.append(char)
-                        # Принудительный переход в LAT после CR или LF
-                        #if char in ('\r', '\n'):
-                        #    current_mode = 'LAT'
-                            # print(f"Принудительно переключено в LAT после символа {char}")
-
-                    # Сдвигаем индекс на длину стоп‑бита (пропускаем его)
-                    i = j
-                    bit_buffer = []
-                else:
-                    # Нет стоп‑бита — продолжаем накапливать
-                    i += 1
-            else:
-                i += 1
-
-        return ''.join(text)
+        codes = self._frame_bits(bits)
+
+        # Режим каждого символа (начальный — LAT) и сразу все символы по таблице;
+        # сами коды переключения режимов в текст не попадают
+        modes, switches = self._symbol_modes(codes, 'LAT')
+        chars = self._CHAR_TABLE[modes, codes][switches < 0]
+        return ''.join(chars.tolist())
 
 
     def decode(self, signal_or_path):
@@ -207,13 +317,14 @@ class RTTYDecoder:
         if signal.ndim > 1:
             signal = signal[:, 0]  # берём левый канал
 
-        # Нормализуем сигнал
-        signal = signal.astype(np.float32)
-        signal /= np.max(np.abs(signal))
-
+        # Коэффициент нормализации; сам сигнал нормализуется по блокам при демодуляции.
+        # Пик ищем по max/min без промежуточного массива np.abs (к тому же для int16
+        # np.abs(-32768) переполняется)
+        peak = max(float(signal.max()), -float(signal.min())) if len(signal) else 0.0
+        scale = 1.0 / peak if peak > 0 else 1.0
 
         # 1. Демодуляция: сигнал → биты
-        bits = self.demodulate(signal)
+        bits = self.demodulate(signal, scale)
 
         # 2. Декодирование: биты → текст
         text = self.decode_bits(bits)
@@ -1,8 +1,26 @@
 import numpy as np
 import sounddevice as sd
-from scipy.signal import butter, filtfilt
+from scipy.signal import butter, sosfilt
+import threading
 import time
 
+
+def _pack_code(code):
+    """Упаковывает 5‑битный код ITA2 в целое число (первый бит — старший)."""
+    value = 0
+    for bit in code:
+        value = (value << 1) | bit
+    return value
+
+
+def _code_table(table, default):
+    """Раскладывает словарь «5‑битный код → значение» в список на все 32 кода."""
+    values = [default] * 32
+    for code, value in table.items():
+        values[_pack_code(code)] = value
+    return values
+
+
 class RTTYDecoder:
     """Декодирует RTTY‑сигнал (FSK) в текст по стандарту ITA2."""
     
@@ -52,79 +70,191 @@ class RTTYDecoder:
         }
     }
 
-    def __init__(self, baud=45.45, mark_freq=1170, space_freq=1000, sample_rate=44100):
+    # Те же таблицы в виде массивов, индекс — упакованный 5‑битный код:
+    # _CHAR_TABLE[режим, код] — символ, _SWITCH_MODES[код] — новый режим или -1
+    _MODES = tuple(ITA2_MODES)
+    _CHAR_TABLE = np.array([_code_table(table, '?') for table in ITA2_MODES.values()],
+                           dtype='U1')
+    _SWITCH_MODES = np.array(
+        _code_table(dict(zip(MODE_SWITCH, map(_MODES.index, MODE_SWITCH.values()))), -1),
+        dtype=np.int8)
+
+    def __init__(self, baud=45.45, mark_freq=1170, space_freq=1000, sample_rate=44100,
+                 detector='goertzel'):
+        if detector not in ('goertzel', 'bandpass'):
+            raise ValueError(f"Неизвестный детектор: {detector}")
         self.baud = baud
         self.mark_freq = mark_freq
         self.space_freq = space_freq
         self.sample_rate = sample_rate
         self.bit_duration = 1.0 / baud  # длительность одного бита (сек)
         self.n_samples_per_bit = int(sample_rate * self.bit_duration)
-        self.buffer = np.array([], dtype=np.float32)
-        self.demodulated_bits = []  # буфер для демодулированных битов
+        self.detector = detector  # 'goertzel' — однобиновое ДПФ, 'bandpass' — полосовые фильтры
+
+        # Энергию считаем по концу каждого бита (80% длины) для точности
+        self._window = int(self.n_samples_per_bit * 0.8)
+
+        # Опорные косинусы и синусы на частотах mark и space (на окно бита) — столбцы
+        # одной вещественной матрицы: энергии обоих тонов для любого числа сегментов
+        # даёт одно умножение float32 без перевода сигнала в комплексный тип
+        t = np.arange(self._window) / sample_rate
+        self._kernels = np.column_stack([
+            np.cos(2 * np.pi * mark_freq * t), np.sin(2 * np.pi * mark_freq * t),
+            np.cos(2 * np.pi * space_freq * t), np.sin(2 * np.pi * space_freq * t),
+        ]).astype(np.float32)
+
+        # Полосовые фильтры (секции второго порядка) рассчитываются один раз
+        self._sos_mark = self._design_bandpass(mark_freq - 60, mark_freq + 60)
+        self._sos_space = self._design_bandpass(space_freq - 60, space_freq + 60)
+
+        # Состояния фильтров переносятся между вызовами — поток фильтруется непрерывно
+        self._zi_mark = np.zeros((len(self._sos_mark), 2))
+        self._zi_space = np.zeros((len(self._sos_space), 2))
+
+        # Кольцевой буфер отсчётов; ёмкость кратна длине бита, поэтому
+        # сегменты никогда не пересекают его конец и читаются без копирования
+        self._ring = np.empty(20 * self.n_samples_per_bit, dtype=np.float32)
+        self._write = 0  # сколько отсчётов записано всего
+        self._read = 0  # сколько отсчётов прочитано всего
+        self._bits = np.empty(4096, dtype=np.uint8)  # буфер для демодулированных битов
+        self._bits_n = 0  # сколько битов в буфере
+        # Буфер битов пополняется из потока PortAudio, а разбирается в основном потоке
+        self._bits_lock = threading.Lock()
         self.current_mode = 'LAT'  # текущий режим декодирования
 
-    def _bandpass_filter(self, signal, low, high, order=5):
-        """Полосовой фильтр для выделения частоты."""
+    def _design_bandpass(self, low, high, order=5):
+        """Рассчитывает полосовой фильтр Баттерворта в виде секций второго порядка."""
         nyq = 0.5 * self.sample_rate
-        low = low / nyq
-        high = high / nyq
-        b, a = butter(order, [low, high], btype='band')
-        return filtfilt(b, a, signal)
-
-
-    def _detect_frequency(self, segment):
-        # Уменьшаем окно до 80% бита для точности
-        window = int(len(segment) * 0.8)
-        segment = segment[-window:]  # берём конец сегмента
-        
-        mark_filtered = self._bandpass_filter(segment, self.mark_freq - 60, self.mark_freq + 60)
-        space_filtered = self._bandpass_filter(segment, self.space_freq - 60, self.space_freq + 60)
-        
-        mark_energy = np.sum(mark_filtered ** 2)
-        space_energy = np.sum(space_filtered ** 2)
-        
-        
-        # Гистерезис: не переключаться, если разница < 10%
-        if abs(mark_energy - space_energy) < 0.2 * (mark_energy + space_energy):
-            return 'mark' if mark_energy > space_energy else 'space'
-        
-        return 'mark' if mark_energy > space_energy else 'space'
+        return butter(order, [low / nyq, high / nyq], btype='band', output='sos')
 
+    def _detect_bits(self, frames):
+        """Определяет биты сразу для матрицы сегментов (одна строка — один бит)."""
+        window = self._window
 
-    def audio_callback(self, in_data, frame_count, time_info, status):
-        """Callback‑функция для потокового захвата аудио."""
-        audio_data = np.frombuffer(in_data, dtype=np.int16)
-        audio_data = audio_data.astype(np.float32) / 32768.0
-        self.buffer = np.concatenate((self.buffer, audio_data))
+        if self.detector == 'bandpass':
+            # Сегменты идут подряд, поэтому фильтруем их одним проходом sosfilt,
+            # продолжая с состояния, оставшегося от предыдущего вызова
+            samples = frames.ravel()
+            mark_filtered, self._zi_mark = sosfilt(self._sos_mark, samples, zi=self._zi_mark)
+            space_filtered, self._zi_space = sosfilt(self._sos_space, samples, zi=self._zi_space)
 
+            mark_energy = np.sum(mark_filtered.reshape(frames.shape)[:, -window:] ** 2, axis=1)
+            space_energy = np.sum(space_filtered.reshape(frames.shape)[:, -window:] ** 2, axis=1)
+            return (mark_energy > space_energy).astype(np.uint8)
 
-        while len(self.buffer) >= self.n_samples_per_bit:
-            # Берём один сегмент (один бит)
-            segment = self.buffer[:self.n_samples_per_bit]
-            self.buffer = self.buffer[self.n_samples_per_bit:]
+        # Энергии всех сегментов — одним матричным умножением на опорные колебания
+        power = (frames[:, -window:] @ self._kernels) ** 2
+        mark_energy = power[:, 0] + power[:, 1]
+        space_energy = power[:, 2] + power[:, 3]
+        return (mark_energy > space_energy).astype(np.uint8)
 
 
-            # Демодуляция сегмента в бит
-            freq_type = self._detect_frequency(segment)
-            bit = 1 if freq_type == 'mark' else 0
+    def _ring_write(self, data):
+        """
+        Дописывает отсчёты int16 в кольцевой буфер (свободного места должно хватать).
+        Перевод во float32 с нормализацией идёт прямо в буфер, без промежуточного массива.
+        """
+        capacity = len(self._ring)
+        start = self._write % capacity
+        first = min(len(data), capacity - start)
+        scale = np.float32(1 / 32768.0)
+        np.multiply(data[:first], scale, out=self._ring[start:start + first], dtype=np.float32)
+        np.multiply(data[first:], scale, out=self._ring[:len(data) - first], dtype=np.float32)
+        self._write += len(data)
+
+    def _demodulate_ring(self):
+        """Демодулирует все полные сегменты из кольцевого буфера."""
+        capacity = len(self._ring)
+        n_bits = (self._write - self._read) // self.n_samples_per_bit
+        while n_bits:
+            # Берём сегменты до конца буфера — это срез без копирования
+            start = self._read % capacity
+            n = min(n_bits, (capacity - start) // self.n_samples_per_bit)
+            frames = self._ring[start:start + n * self.n_samples_per_bit]
+            frames = frames.reshape(n, self.n_samples_per_bit)
+
+            # Демодуляция сегментов в биты и сохранение
+            self._append_bits(self._detect_bits(frames))
+            self._read += n * self.n_samples_per_bit
+            n_bits -= n
+
+    def _append_bits(self, bits):
+        """Дописывает биты в буфер, при нехватке места удваивая его."""
+        with self._bits_lock:
+            end = self._bits_n + len(bits)
+            if end > len(self._bits):
+                grown = np.empty(max(end, 2 * len(self._bits)), dtype=np.uint8)
+                grown[:self._bits_n] = self._bits[:self._bits_n]
+                self._bits = grown
+            self._bits[self._bits_n:end] = bits
+            self._bits_n = end
 
-            # Сохраняем демодулированный бит
-            self.demodulated_bits.append(bit)
+    def audio_callback(self, in_data, frame_count, time_info, status):
+        """Callback‑функция для потокового захвата аудио."""
+        audio_data = np.frombuffer(in_data, dtype=np.int16)  # представление, без копии
 
+        # Пишем порциями не больше свободного места и сразу демодулируем
+        # накопленные полные сегменты, так что буфер не переполняется
+        while len(audio_data):
+            free = len(self._ring) - (self._write - self._read)
+            self._ring_write(audio_data[:free])
+            audio_data = audio_data[free:]
+            self._demodulate_ring()
 
-        if len(self.buffer) > 10 * self.n_samples_per_bit:
-            self.buffer = self.buffer[-10 * self.n_samples_per_bit:]
         return in_data, 'continue'  # Исправленный возврат
 
-    def _decode_ita2_char(self, code, current_mode):
-        """Декодирует 5‑битный код в символ с учётом текущего режима."""
-        code_tuple = tuple(code)
-        if code_tuple in self.MODE_SWITCH:
-            return self.MODE_SWITCH[code_tuple]
-        if (current_mode in self.ITA2_MODES
-                and code_tuple in self.ITA2_MODES[current_mode]):
-            return self.ITA2_MODES[current_mode][code_tuple]
-        return '?'
+    def _symbol_modes(self, codes, initial_mode):
+        """
+        Определяет режим (индекс в _MODES) для каждого символа: действует последнее
+        предшествующее переключение, а до первого переключения — initial_mode.
+        Возвращает режимы и признаки переключения (-1 для обычных символов).
+        """
+        switches = self._SWITCH_MODES[codes]
+        positions = np.where(switches >= 0, np.arange(len(codes)), -1)
+        last_switch = np.maximum.accumulate(positions)
+        modes = np.where(last_switch >= 0, switches[last_switch], self._MODES.index(initial_mode))
+        return modes, switches
+
+    @staticmethod
+    def _pack_codes(bits, starts):
+        """Упаковывает 5 битов данных после каждого старт‑бита в целые коды."""
+        data = bits[np.asarray(starts, dtype=np.intp)[:, None] + np.arange(1, 6)]
+        return data @ np.array([16, 8, 4, 2, 1], dtype=np.uint8)
+
+    def _frame_bits(self, bits):
+        """
+        Выделяет символы из битового потока: старт‑бит 0, 5 битов данных,
+        стоп‑бит из одной или нескольких 1.
+        Возвращает упакованные коды символов и индекс конца разбора.
+        """
+        bits = np.asarray(bits, dtype=np.uint8)
+        buf = bits.tobytes()  # поиск нулей — через bytes.find
+        n = len(buf)
+
+        starts = []
+        i = 0
+        while i < n - 6:  # нужно минимум 7 битов (старт + 5 данных + стоп)
+            # Переходим к ближайшему старт‑биту (0)
+            i = buf.find(b'\x00', i)
+            if i < 0 or i >= n - 6:
+                break
+
+            # Если стоп‑бит не найден (нет ни одной 1), сдвигаемся на бит
+            if buf[i + 6] != 1:
+                i += 1
+                continue
+
+            starts.append(i)
+
+            # Переходим к следующему возможному старт‑биту (после стоп‑бита)
+            i = buf.find(b'\x00', i + 6)
+            if i < 0:
+                break
+
+        if i < 0:
+            i = n  # до конца одни единицы — разобрано всё
+
+        return self._pack_codes(bits, starts), i
 
     def decode_bits(self, bits):
         """
@@ -132,72 +262,51 @@ class RTTYDecoder:
         Учитывает старт/стоп‑биты и переключение режимов (LAT/RUS/FIGS).
         Поддерживает стоп‑бит длиной 1.5.
         """
-        text = []
-        current_mode = self.current_mode  # берём текущий режим из атрибута
-        i = 0  # индекс в массиве bits
-
-        while i < len(bits) - 6:  # нужно минимум 7 битов (старт + 5 данных + стоп)
-            # Проверяем старт‑бит (должен быть 0)
-            if bits[i] != 0:
-                i += 1
-                continue
-
-            # Извлекаем 5 битов данных
-            data_bits = bits[i + 1: i + 6]
+        codes, i = self._frame_bits(bits)
 
-            # Ищем стоп‑бит: минимум одна 1 после данных
-            j = i + 6
-            stop_length = 0
-            while j < len(bits) and bits[j] == 1:
-                stop_length += 1
-                j += 1
-
-            # Если стоп‑бит не найден (нет ни одной 1), пропускаем
-            if stop_length < 1:
-                i += 1
-                continue
+        # Режим каждого символа (начальный берём из атрибута) и сразу все символы
+        # по таблице; сами коды переключения режимов в текст не попадают
+        modes, switches = self._symbol_modes(codes, self.current_mode)
+        chars = self._CHAR_TABLE[modes, codes][switches < 0]
 
-            # Декодируем символ
-            char = self._decode_ita2_char(data_bits, current_mode)
-
-            # Обрабатываем переключение режимов
-            if char == 'RUS':
-                current_mode = 'RUS'
-                self.current_mode = 'RUS'  # ← сохраняем в атрибут
-            elif char == 'FIGS':
-                current_mode = 'FIGS'
-                self.current_mode = 'FIGS'  # ← сохраняем в атрибут
-            elif char == 'LAT':
-                current_mode = 'LAT'
-                self.current_mode = 'LAT'
-            else:
-                text.append(char)
-    
-            # Переходим к следующему возможному старт‑биту (после стоп‑бита)
-            i = j
+        # Сохраняем в атрибут режим после последнего переключения
+        new_modes = switches[switches >= 0]
+        if len(new_modes):
+            self.current_mode = self._MODES[new_modes[-1]]
 
-        return ''.join(text), i
+        return ''.join(chars.tolist()), i
 
 
 
     def _process_decoding(self):
         """Декодирует накопленные биты и выводит текст."""
-        if len(self.demodulated_bits) < 7:
+        # Под блокировкой берём только снимок: callback пишет лишь за его конец,
+        # а при расширении буфера копирует начало, поэтому снимок не меняется
+        with self._bits_lock:
+            bits = self._bits[:self._bits_n]
+        if len(bits) < 7:
             return  # мало битов — ждём
 
         # Декодируем
-        text, num_bits = self.decode_bits(self.demodulated_bits)
+        text, num_bits = self.decode_bits(bits)
         if text:
             text = text.replace('\r', '\n')  # упрощённая обработка \r
             while '\n\n' in text:
                 text = text.replace('\n\n', '\n')
             print(text, end='', flush=True)
-            # Удаляем только обработанные биты
-            self.demodulated_bits = self.demodulated_bits[num_bits:]
+
+        # Удаляем обработанные биты (режим уже сохранён в атрибуте):
+        # сдвигаем остаток, включая дописанное за это время, в начало буфера
+        if num_bits:
+            with self._bits_lock:
+                rest = self._bits_n - num_bits
+                self._bits[:rest] = self._bits[num_bits:self._bits_n]
+                self._bits_n = rest
 
     def start_streaming(self):
         """Запускает потоковую обработку с микрофона."""
-        self.demodulated_bits = []
+        with self._bits_lock:
+            self._bits_n = 0
         self.current_mode = 'LAT'
 
         try: